@@ -8,9 +8,9 @@ import logging
 import pprint
 import numpy as np
 import time
+import pathlib
 
 from utils import *
-from dateutil.parser import parse
 import xml.etree.ElementTree as ET
 
 
@@ -18,30 +18,22 @@ def reformat_sondehub_data(telem):
 
     output = {}
 
-    # Get keys and sort, now we can pull out data in time order.
-    _telem_dates = list(telem.keys())
-    _telem_dates.sort()
+    # Sort into time order. The telemetry is already keyed (and so de-duped) by datetime.
+    (_dates, _entries) = zip(*telem.items())
+    _order = telemetry_time_order(_dates)
 
-    _first = telem[_telem_dates[0]]
-    _last = telem[_telem_dates[-1]]
+    _first = _entries[_order[0]]
+    _last = _entries[_order[-1]]
 
     output['serial'] = _first['payload_callsign']
     output['last_time'] = _last['datetime']
-
-    _path = []
-    
-    for _entry in _telem_dates:
-        _a = telem[_entry]
-
-        _path.append([_a['lat'], _a['lon'], _a['alt']])
-
-    output['path'] = _path
+    output['path'] = telemetry_to_path(_entries, _order)
 
     return output
 
 
 def _telem_to_kml_folder(telem_data, absolute=True, extrude=True, last_only=False):
-    ''' Convert a single sonde log file to a KML Folder object '''
+    ''' Convert a single sonde log file to a KML Folder XML string '''
 
     # Read file.
     _flight_data = reformat_sondehub_data(telem_data)
@@ -50,41 +42,31 @@ def _telem_to_kml_folder(telem_data, absolute=True, extrude=True, last_only=Fals
     _landing_time = _flight_data["last_time"]
     _landing_pos = _flight_data["path"][-1]
 
-    _folder = ET.Element("Folder")
-    _name = ET.SubElement(_folder, "name")
-    _name.text = _flight_serial
-
     # Generate the placemark & flight track.
-    _folder.append(coordinates_to_kml_placemark(_landing_pos[0], _landing_pos[1], _landing_pos[2],
-                                                name=_flight_serial, description=_landing_time, absolute=absolute))
+    _placemarks = [coordinates_to_kml_placemark_xml(_landing_pos[0], _landing_pos[1], _landing_pos[2],
+                                                    name=_flight_serial, description=_landing_time, absolute=absolute)]
     if not last_only:
-        _folder.append(path_to_kml_placemark(_flight_data["path"], name="Track",
-                                             absolute=absolute, extrude=extrude))
+        _placemarks.append(path_to_kml_placemark_xml(_flight_data["path"], name="Track",
+                                                     absolute=absolute, extrude=extrude))
 
-    return _folder
+    return folder_to_kml_xml(_flight_serial, _placemarks)
 
 INFILE = 'amateur.json'
 OUTFILE = 'amateur.kml'
 
 
-_f = open(INFILE, 'r')
-data = json.loads(_f.read())
-_f.close()
+data = json_loads(pathlib.Path(INFILE).read_bytes())
 
 
 _callsigns = list(data.keys())
 
-kml_root = ET.Element("kml", xmlns="http://www.opengis.net/kml/2.2")
-kml_doc = ET.SubElement(kml_root, "Document")
-
-
-for call in _callsigns:
-    logging.debug(f"Converting {call} to KML")
-    try:
-        kml_doc.append(_telem_to_kml_folder(data[call], absolute=True,
-                                                extrude=True, last_only=False))
-    except Exception:
-        logging.exception(f"Failed to convert {call} to KML")
+def _folders():
+    for call in _callsigns:
+        logging.debug(f"Converting {call} to KML")
+        try:
+            yield _telem_to_kml_folder(data[call], absolute=True,
+                                       extrude=True, last_only=False)
+        except Exception:
+            logging.exception(f"Failed to convert {call} to KML")
 
-tree = ET.ElementTree(kml_root)
-tree.write(OUTFILE, encoding="UTF-8", xml_declaration=True)
\ No newline at end of file
+write_kml_folders(_folders(), OUTFILE)
@@ -5,12 +5,44 @@ import glob
 import os
 import sys
 import logging
+import math
 import pprint
 import numpy as np
 import time
+import multiprocessing
+from functools import partial
 
 from utils import *
-from dateutil.parser import parse
+
+
+def _process_files(filenames, observer, observer_epoch, min_el, window, max_alt):
+    """
+    Read a batch of summary files and return a list of (serial, datetime, elevation, bearing) tuples
+    for every entry above min_el, and within window seconds of observer_epoch.
+    """
+    _data = load_summary_files(filenames)
+    if not _data:
+        return []
+
+    _lats = _data['lat']
+    _lons = _data['lon']
+    _alts = _data['alt']
+
+    # Throw away anything outside the time window, or too far away to be seen, before doing the full calculation.
+    _candidates = np.flatnonzero(
+        (np.abs(_data['t'] - observer_epoch) < window)
+        & visibility_bbox_mask(observer, _lats, _lons, min_el, max_alt)
+    )
+    if len(_candidates) == 0:
+        return []
+
+    _pos_info = position_info_vec(observer, _lats[_candidates], _lons[_candidates], _alts[_candidates])
+
+    return [
+        (_data['serial'][_i], _data['datetime'][_i], _pos_info['elevation'][_j], _pos_info['bearing'][_j])
+        for _j, _i in enumerate(_candidates)
+        if _pos_info['elevation'][_j] > min_el
+    ]
 
 
 if __name__ == "__main__":
@@ -24,6 +56,7 @@ if __name__ == "__main__":
     parser.add_argument("--min_el", type=float, default=-5.0, help="Elevation threshold to filter sondes.")
     parser.add_argument("--datetime", type=str, default="2024-04-08T19:00:15Z", help="Time to search from")
     parser.add_argument("--window", type=float, default=3600*4, help="Time window (seconds)")
+    parser.add_argument("--max_alt", type=float, default=50000, help="Maximum sonde altitude to consider when pre-filtering by distance, in metres.")
     parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Verbose output (set logging level to DEBUG)")
     args = parser.parse_args()
 
@@ -38,7 +71,7 @@ if __name__ == "__main__":
     )
 
     observer = (args.lat, args.lon, args.alt)
-    observer_time = parse(args.datetime)
+    observer_time = parse_iso_datetime(args.datetime)
     logging.info(f"Observer position: {observer}, time: {observer_time.isoformat()}")
 
     # Get list of sonde summary files.
@@ -46,32 +79,31 @@ if __name__ == "__main__":
 
     logging.info(f"Working on {len(_file_list)} files.")
 
-    serials = {}
+    # Only the serial numbers are written out, so that's all we keep.
+    serials = set()
+
+    # Each file is independent, so split them into a few batches per CPU. Each worker reads its own
+    # batch of files, and runs position_info_vec over the whole batch at once.
+    _processes = os.cpu_count() or 1
+    _batch_size = max(1, math.ceil(len(_file_list) / (_processes * 4)))
+    _batches = [_file_list[_i:_i + _batch_size] for _i in range(0, len(_file_list), _batch_size)]
 
-    for _file in _file_list:
-        logging.debug(f"Testing file {_file}.")
+    _worker = partial(_process_files, observer=observer, observer_epoch=observer_time.timestamp(),
+                      min_el=args.min_el, window=args.window, max_alt=args.max_alt)
 
-        _data = load_summary_file(_file)
-        if _data:
-            for _entry in _data:
-                _sonde_pos = (_entry['lat'], _entry['lon'], _entry['alt'])
+    with multiprocessing.Pool(_processes) as _pool:
+        for _matches in _pool.imap_unordered(_worker, _batches):
+            for (_serial, _datetime, _elevation, _bearing) in _matches:
+                logging.info(f"Match! - {_datetime}: {_serial} at {_elevation} degrees elevation, {_bearing} degrees azimuth.")
+                serials.add(_serial)
 
-                _pos_info = position_info(observer, _sonde_pos)
 
-                if _pos_info['elevation'] > args.min_el:
-                    _pos_time = parse(_entry['datetime'])
-                    _time_diff = abs((observer_time-_pos_time).total_seconds())
-                    if _time_diff < args.window:
-                        logging.info(f"Match! - {_entry['datetime']}: {_entry['serial']} at {_pos_info['elevation']} degrees elevation, {_pos_info['bearing']} degrees azimuth.")
-                        serials[_entry['serial']] = _entry
-                    
-    
-    logging.info(f"Found {len(list(serials.keys()))} matching flights.")
+    logging.info(f"Found {len(serials)} matching flights.")
 
 
     logging.info(f"Writing serial list to {args.output}")
     _out = open(args.output, 'w')
-    for _serial in list(serials.keys()):
+    for _serial in sorted(serials):
         _out.write(f"{_serial}\n")
     _out.close()
 
@@ -10,7 +10,6 @@ import numpy as np
 import time
 
 from utils import *
-from dateutil.parser import parse
 
 
 if __name__ == "__main__":
@@ -5,45 +5,48 @@
 #   Copyright (C) 2021  Mark Jessop <vk5qi@rfhead.net>
 #   Released under GNU GPL v3 or later
 #
+import datetime
 import json
 import logging
 import glob
 import math
 import os.path
+import itertools
+import pathlib
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from math import radians, degrees, sin, cos, atan2, sqrt, pi
 import numpy as np
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 
+try:
+    # orjson is optional, but much faster than the standard library json parser.
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-def position_info(listener, balloon):
-    """
-    Calculate and return information from 2 (lat, lon, alt) tuples
+try:
+    from numba import njit, prange
+except ImportError:
+    # numba is optional - fall back to plain python if it isn't available.
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
 
-    Copyright 2012 (C) Daniel Richman; GNU GPL 3
+    prange = range
 
-    Returns a dict with:
 
-     - angle at centre
-     - great circle distance
-     - distance in a straight line
-     - bearing (azimuth or initial course)
-     - elevation (altitude)
-
-    Input and output latitudes, longitudes, angles, bearings and elevations are
-    in degrees, and input altitudes and output distances are in meters.
+@njit(cache=True, fastmath=True)
+def _position_info_core(lat1, lon1, alt1, lat2, lon2, alt2, radius):
     """
+    Scalar maths behind position_info. Latitudes and longitudes are in radians.
 
-    # Earth:
-    # radius = 6371000.0
-    radius = 6364963.0  # Optimized for Australia :-)
-
-    (lat1, lon1, alt1) = listener
-    (lat2, lon2, alt2) = balloon
-
-    lat1 = radians(lat1)
-    lat2 = radians(lat2)
-    lon1 = radians(lon1)
-    lon2 = radians(lon2)
+    Returns a tuple of (elevation, bearing, angle_at_centre, straight_distance), all in radians / metres.
+    """
 
     # Calculate the bearing, the angle at the centre, and the great circle
     # distance using Vincenty's_formulae with f = 0 (a sphere). See
@@ -51,13 +54,12 @@ def position_info(listener, balloon):
     # http://en.wikipedia.org/wiki/Great-circle_navigation and
     # http://en.wikipedia.org/wiki/Vincenty%27s_formulae
     d_lon = lon2 - lon1
-    sa = cos(lat2) * sin(d_lon)
-    sb = (cos(lat1) * sin(lat2)) - (sin(lat1) * cos(lat2) * cos(d_lon))
-    bearing = atan2(sa, sb)
-    aa = sqrt((sa ** 2) + (sb ** 2))
-    ab = (sin(lat1) * sin(lat2)) + (cos(lat1) * cos(lat2) * cos(d_lon))
-    angle_at_centre = atan2(aa, ab)
-    great_circle_distance = angle_at_centre * radius
+    sa = math.cos(lat2) * math.sin(d_lon)
+    sb = (math.cos(lat1) * math.sin(lat2)) - (math.sin(lat1) * math.cos(lat2) * math.cos(d_lon))
+    bearing = math.atan2(sa, sb)
+    aa = math.sqrt((sa ** 2) + (sb ** 2))
+    ab = (math.sin(lat1) * math.sin(lat2)) + (math.cos(lat1) * math.cos(lat2) * math.cos(d_lon))
+    angle_at_centre = math.atan2(aa, ab)
 
     # Armed with the angle at the centre, calculating the remaining items
     # is a simple 2D triangley circley problem:
@@ -73,16 +75,60 @@ def position_info(listener, balloon):
     # dividing both sides by cos elevation
     ta = radius + alt1
     tb = radius + alt2
-    ea = (cos(angle_at_centre) * tb) - ta
-    eb = sin(angle_at_centre) * tb
-    elevation = atan2(ea, eb)
+    ea = (math.cos(angle_at_centre) * tb) - ta
+    eb = math.sin(angle_at_centre) * tb
+    elevation = math.atan2(ea, eb)
 
     # Use cosine rule to find unknown side.
-    distance = sqrt((ta ** 2) + (tb ** 2) - 2 * tb * ta * cos(angle_at_centre))
+    distance = math.sqrt((ta ** 2) + (tb ** 2) - 2 * tb * ta * math.cos(angle_at_centre))
 
     # Give a bearing in range 0 <= b < 2pi
     if bearing < 0:
-        bearing += 2 * pi
+        bearing += 2 * math.pi
+
+    return (elevation, bearing, angle_at_centre, distance)
+
+
+def position_info(listener, balloon, elevation_only=False):
+    """
+    Calculate and return information from 2 (lat, lon, alt) tuples
+
+    Copyright 2012 (C) Daniel Richman; GNU GPL 3
+
+    Returns a dict with:
+
+     - angle at centre
+     - great circle distance
+     - distance in a straight line
+     - bearing (azimuth or initial course)
+     - elevation (altitude)
+
+    If elevation_only is set, only the elevation (in degrees) is returned.
+
+    Input and output latitudes, longitudes, angles, bearings and elevations are
+    in degrees, and input altitudes and output distances are in meters.
+    """
+
+    # Earth:
+    # radius = 6371000.0
+    radius = 6364963.0  # Optimized for Australia :-)
+
+    (lat1, lon1, alt1) = listener
+    (lat2, lon2, alt2) = balloon
+
+    lat1 = radians(lat1)
+    lat2 = radians(lat2)
+    lon1 = radians(lon1)
+    lon2 = radians(lon2)
+
+    (elevation, bearing, angle_at_centre, distance) = _position_info_core(
+        lat1, lon1, float(alt1), lat2, lon2, float(alt2), radius
+    )
+
+    if elevation_only:
+        return degrees(elevation)
+
+    great_circle_distance = angle_at_centre * radius
 
     return {
         "listener": listener,
@@ -100,8 +146,121 @@ def position_info(listener, balloon):
     }
 
 
+def position_info_vec(listener, lats, lons, alts):
+    """
+    Vectorised version of position_info, for a single listener and many balloon positions.
+
+    lats, lons and alts are array-likes of balloon positions (degrees, degrees, metres).
+
+    Returns a dict of numpy arrays with:
+
+     - angle at centre
+     - great circle distance
+     - distance in a straight line
+     - bearing (azimuth or initial course)
+     - elevation (altitude)
+    """
+
+    # Must match position_info above.
+    radius = 6364963.0
+
+    (lat1, lon1, alt1) = listener
+
+    lat1 = radians(lat1)
+    lon1 = radians(lon1)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    alt2 = np.asarray(alts, dtype=np.float64)
+
+    # Same maths as position_info, with the listener terms only calculated once.
+    cos_lat2 = np.cos(lat2)
+    sin_lat2 = np.sin(lat2)
+    d_lon = lon2 - lon1
+    cos_d_lon = np.cos(d_lon)
+    sa = cos_lat2 * np.sin(d_lon)
+    sb = (cos(lat1) * sin_lat2) - (sin(lat1) * cos_lat2 * cos_d_lon)
+    bearing = np.arctan2(sa, sb)
+    aa = np.hypot(sa, sb)
+    ab = (sin(lat1) * sin_lat2) + (cos(lat1) * cos_lat2 * cos_d_lon)
+    angle_at_centre = np.arctan2(aa, ab)
+    great_circle_distance = angle_at_centre * radius
+
+    ta = radius + alt1
+    tb = radius + alt2
+    cos_angle = np.cos(angle_at_centre)
+    ea = (cos_angle * tb) - ta
+    eb = np.sin(angle_at_centre) * tb
+    elevation = np.arctan2(ea, eb)
+
+    distance = np.sqrt((ta ** 2) + (tb ** 2) - 2 * tb * ta * cos_angle)
+
+    # Give a bearing in range 0 <= b < 2pi
+    bearing = np.where(bearing < 0, bearing + 2 * pi, bearing)
+
+    return {
+        "angle_at_centre": np.degrees(angle_at_centre),
+        "angle_at_centre_radians": angle_at_centre,
+        "bearing": np.degrees(bearing),
+        "bearing_radians": bearing,
+        "great_circle_distance": great_circle_distance,
+        "straight_distance": distance,
+        "elevation": np.degrees(elevation),
+        "elevation_radians": elevation,
+    }
+
+
+def visibility_bbox_mask(listener, lats, lons, min_el, max_alt):
+    """
+    Cheap pre-filter for position_info_vec.
+
+    Returns a boolean array which is False for any balloon position that cannot possibly be above
+    min_el (degrees) as seen from the listener, assuming the balloon is no higher than max_alt (metres).
+    This is conservative - positions which pass still need to be checked with position_info_vec.
+    """
+
+    # Must match position_info above.
+    radius = 6364963.0
+
+    (lat1, lon1, alt1) = listener
 
-def getDensity(altitude):
+    # Largest angle at centre at which a balloon at max_alt is still at min_el.
+    # From the sine rule on the triangle with sides (r + alt1) and (r + max_alt).
+    _el = radians(min_el)
+    _ratio = min(1.0, (radius + alt1) * cos(_el) / (radius + max_alt))
+    _max_angle = pi / 2 - _el - math.asin(_ratio)
+
+    _lats = np.asarray(lats, dtype=np.float64)
+    _lons = np.asarray(lons, dtype=np.float64)
+
+    _mask = np.abs(_lats - lat1) <= degrees(_max_angle)
+
+    # Longitude bounds of a spherical cap only exist if it doesn't cover a pole.
+    if abs(radians(lat1)) + _max_angle < pi / 2:
+        _max_dlon = degrees(math.asin(sin(_max_angle) / cos(radians(lat1))))
+        _dlon = np.abs((_lons - lon1 + 180.0) % 360.0 - 180.0)
+        _mask &= _dlon <= _max_dlon
+
+    return _mask
+
+
+# Atmosphere model lookup tables, used by _getDensity_impl
+_ATMOS_ALTITUDES = np.array([0, 11000, 20000, 32000, 47000, 51000, 71000, 84852], dtype=np.float64)
+_ATMOS_PRESSURE_RELS = np.array([
+    1,
+    2.23361105092158e-1,
+    5.403295010784876e-2,
+    8.566678359291667e-3,
+    1.0945601337771144e-3,
+    6.606353132858367e-4,
+    3.904683373343926e-5,
+    3.6850095235747942e-6,
+], dtype=np.float64)
+_ATMOS_TEMPERATURES = np.array([288.15, 216.65, 216.65, 228.65, 270.65, 270.65, 214.65, 186.946], dtype=np.float64)
+_ATMOS_TEMP_GRADS = np.array([-6.5, 0, 1, 2.8, 0, -2.8, -2, 0], dtype=np.float64)
+
+
+@njit(cache=True, fastmath=True)
+def _getDensity_impl(altitude):
     """ 
 	Calculate the atmospheric density for a given altitude in metres.
 	This is a direct port of the oziplotter Atmosphere class
@@ -120,25 +279,16 @@ def getDensity(altitude):
     deltaTemperature = 0.0
 
     # Lookup Tables
-    altitudes = [0, 11000, 20000, 32000, 47000, 51000, 71000, 84852]
-    pressureRels = [
-        1,
-        2.23361105092158e-1,
-        5.403295010784876e-2,
-        8.566678359291667e-3,
-        1.0945601337771144e-3,
-        6.606353132858367e-4,
-        3.904683373343926e-5,
-        3.6850095235747942e-6,
-    ]
-    temperatures = [288.15, 216.65, 216.65, 228.65, 270.65, 270.65, 214.65, 186.946]
-    tempGrads = [-6.5, 0, 1, 2.8, 0, -2.8, -2, 0]
+    altitudes = _ATMOS_ALTITUDES
+    pressureRels = _ATMOS_PRESSURE_RELS
+    temperatures = _ATMOS_TEMPERATURES
+    tempGrads = _ATMOS_TEMP_GRADS
     gMR = gravity * airMolWeight / RGas
 
-    # Pick a region to work in
+    # Pick a region to work in. Above the top of the table, stay in the last region.
     i = 0
     if altitude > 0:
-        while altitude > altitudes[i + 1]:
+        while i < len(altitudes) - 2 and altitude > altitudes[i + 1]:
             i = i + 1
 
     # Lookup based on region
@@ -169,11 +319,61 @@ def getDensity(altitude):
     return density
 
 
+@njit(cache=True, parallel=True)
+def _getDensity_batch(altitudes):
+    """ Run _getDensity_impl over a 1-D array of altitudes """
+    densities = np.empty(len(altitudes), dtype=np.float64)
+    for i in prange(len(altitudes)):
+        densities[i] = _getDensity_impl(altitudes[i])
+    return densities
+
+
+# getDensity is smooth over the altitudes we care about, so pre-compute it at 1 metre resolution.
+# The top of the model is 84852 m. The table is only built on first use, as most scripts never need it.
+_DENSITY_MAX_ALT = 84852
+_DENSITY_LUT = None
+
+
+def _density_lut():
+    """ Return the density lookup table, building it if this is the first call """
+    global _DENSITY_LUT
+
+    if _DENSITY_LUT is None:
+        # Build the table serially - numba's parallel thread pool isn't fork-safe, and step2.py forks worker processes.
+        _alt_grid = np.arange(0, _DENSITY_MAX_ALT + 1, 1.0)
+        _DENSITY_LUT = np.fromiter((_getDensity_impl(a) for a in _alt_grid), dtype=np.float64, count=len(_alt_grid))
+
+    return _DENSITY_LUT
+
+
+def getDensity(altitude, exact=False):
+    """
+    Look up the atmospheric density for a given altitude in metres (or a numpy array of altitudes).
+
+    By default altitudes are truncated to the metre, and clipped to the 0 - 84852 m range of the model.
+    Note this means altitudes below 0 m return the sea level density, rather than being extrapolated.
+    If exact is set, the density is calculated directly from the model instead.
+    """
+    if isinstance(altitude, np.ndarray):
+        if exact:
+            _alt = altitude.astype(np.float64)
+            return _getDensity_batch(_alt.ravel()).reshape(_alt.shape)
+        return np.take(_density_lut(), np.clip(altitude.astype(np.int64), 0, _DENSITY_MAX_ALT))
+
+    if exact:
+        return _getDensity_impl(float(altitude))
+
+    return _density_lut()[min(max(int(altitude), 0), _DENSITY_MAX_ALT)]
+
+
 def seaLevelDescentRate(descent_rate, altitude):
-    """ Calculate the descent rate at sea level, for a given descent rate at altitude """
+    """
+    Calculate the descent rate at sea level, for a given descent rate at altitude.
+    Accepts either scalars or numpy arrays of descent rates and altitudes.
+    """
 
-    rho = getDensity(altitude)
-    return math.sqrt((rho / 1.225) * math.pow(descent_rate, 2))
+    rho = getDensity(np.asarray(altitude, dtype=np.float64))
+    return np.sqrt(rho / 1.225) * np.abs(np.asarray(descent_rate, dtype=np.float64))
 
 
 def get_sonde_file_list(folder="."):
@@ -181,13 +381,102 @@ def get_sonde_file_list(folder="."):
     return glob.glob(os.path.join(folder,"*/*/*.json"))
 
 
-def load_summary_file(filename):
-    _f = open(filename,'r')
-    _data = _f.read()
-    _f.close()
+def parse_iso_datetime(datetime_str):
+    """
+    Parse a strict ISO8601 datetime string (as used by SondeHub), handling a trailing 'Z'.
+    Datetimes without a timezone are assumed to be UTC, to match the SondeHub data.
+    """
+    if datetime_str.endswith('Z'):
+        datetime_str = datetime_str[:-1] + '+00:00'
+
+    _dt = datetime.datetime.fromisoformat(datetime_str)
+    if _dt.tzinfo is None:
+        _dt = _dt.replace(tzinfo=datetime.timezone.utc)
+
+    return _dt
+
+
+# Matches an explicit timezone offset (e.g. +00:00 or -0500) at the end of an ISO8601 datetime.
+_TZ_OFFSET = re.compile(r'T.*[+-]\d\d:?\d\d$')
+
+
+def datetimes_to_datetime64(datetimes):
+    """
+    Convert a list of SondeHub ISO8601 datetime strings into a numpy datetime64[us] array, in UTC.
+    Datetimes without a 'Z' or offset are assumed to be UTC. Raises ValueError if any can't be parsed.
+    """
+    _datetimes = []
+    for _dt in datetimes:
+        if _dt.endswith('Z'):
+            _dt = _dt[:-1]
+        elif _TZ_OFFSET.search(_dt):
+            # numpy only warns about (and will eventually refuse) explicit offsets, so convert these ourselves.
+            _dt = parse_iso_datetime(_dt).astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat()
+        _datetimes.append(_dt)
+
+    return np.array(_datetimes, dtype='datetime64[us]')
+
+
+def datetimes_to_epoch(datetimes):
+    """ Convert a list of SondeHub ISO8601 datetime strings into a numpy array of epoch seconds """
+    return datetimes_to_datetime64(datetimes).astype(np.int64) / 1e6
+
 
+def _read_file_bytes(filename):
+    """ Read a file's contents, returning None (and logging) if it can't be read """
     try:
-        data = json.loads(_data)
+        return pathlib.Path(filename).read_bytes()
+    except OSError:
+        logging.exception(f"Failed to read {filename}")
+        return None
+
+
+def read_files(file_list, max_workers=16):
+    """
+    Read a list of files using a pool of threads, so the disk reads overlap with whatever
+    is being done with the contents. Yields (filename, contents) tuples in the order of file_list.
+    contents is None if the file could not be read.
+
+    Only 2*max_workers reads are kept in flight at once, so memory use doesn't grow with the number of files.
+    """
+    _files = iter(file_list)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as _ex:
+        _pending = deque(
+            (_filename, _ex.submit(_read_file_bytes, _filename))
+            for _filename in itertools.islice(_files, 2 * max_workers)
+        )
+
+        while _pending:
+            (_filename, _future) = _pending.popleft()
+
+            # Top up the queue before handing this one over.
+            for _next in itertools.islice(_files, 1):
+                _pending.append((_next, _ex.submit(_read_file_bytes, _next)))
+
+            yield (_filename, _future.result())
+
+
+def _summary_entries_to_arrays(entries):
+    """ Convert a list of summary entries into the dict of arrays returned by load_summary_file """
+    _datetimes = [_entry['datetime'] for _entry in entries]
+
+    return {
+        'serial': [_entry['serial'] for _entry in entries],
+        'datetime': _datetimes,
+        'lat': np.fromiter((_entry['lat'] for _entry in entries), dtype=np.float64, count=len(entries)),
+        'lon': np.fromiter((_entry['lon'] for _entry in entries), dtype=np.float64, count=len(entries)),
+        'alt': np.fromiter((_entry['alt'] for _entry in entries), dtype=np.float64, count=len(entries)),
+        't': datetimes_to_epoch(_datetimes),
+    }
+
+
+def _load_summary_entries(filename, data=None):
+    """ Read in a SondeHub summary file and return its list of entries, or None if it isn't valid """
+    _data = pathlib.Path(filename).read_bytes() if data is None else data
+
+    try:
+        data = json_loads(_data)
 
         # Summary data only has 3 entries, launch, burst and landing.
         if len(data) != 3:
@@ -198,6 +487,99 @@ def load_summary_file(filename):
         return None
 
 
+def load_summary_file(filename, data=None):
+    """
+    Read in a SondeHub summary file, and return it as a dict of arrays with:
+
+     - serial: list of serial numbers
+     - datetime: list of datetime strings
+     - lat, lon, alt: float64 numpy arrays
+     - t: float64 numpy array of epoch seconds
+
+    If the file contents have already been read, they can be passed in as data.
+    """
+    _entries = _load_summary_entries(filename, data=data)
+    if not _entries:
+        return None
+
+    try:
+        return _summary_entries_to_arrays(_entries)
+    except ValueError as e:
+        logging.warning(f"Could not parse {filename}: {e}")
+        return None
+    except:
+        return None
+
+
+def load_summary_files(filenames):
+    """
+    Read in a list of SondeHub summary files, and return them as a single dict of arrays,
+    as per load_summary_file. Invalid files are skipped. Returns None if there are no valid files.
+    """
+    _entries = []
+    for _filename in filenames:
+        _data = _load_summary_entries(_filename)
+        if _data:
+            _entries.extend(_data)
+
+    if not _entries:
+        return None
+
+    try:
+        return _summary_entries_to_arrays(_entries)
+    except:
+        # Something in this batch is bad - fall back to loading the files one at a time, skipping the bad ones.
+        _files = [_data for _data in (load_summary_file(_filename) for _filename in filenames) if _data]
+        if not _files:
+            return None
+
+        return {
+            'serial': [_serial for _data in _files for _serial in _data['serial']],
+            'datetime': [_datetime for _data in _files for _datetime in _data['datetime']],
+            'lat': np.concatenate([_data['lat'] for _data in _files]),
+            'lon': np.concatenate([_data['lon'] for _data in _files]),
+            'alt': np.concatenate([_data['alt'] for _data in _files]),
+            't': np.concatenate([_data['t'] for _data in _files]),
+        }
+
+
+# KML structure is fixed, so rather than building it up element-by-element we fill in these templates.
+KML_POINT_PLACEMARK_TEMPLATE = (
+    "<Placemark><name>{name}</name><description>{description}</description>"
+    "<Style><IconStyle><scale>{scale}</scale><Icon><href>{icon}</href></Icon></IconStyle></Style>"
+    "<Point>{altitude_mode}<coordinates>{lon:.6f},{lat:.6f},{alt:.6f}</coordinates></Point></Placemark>"
+)
+
+KML_PATH_PLACEMARK_TEMPLATE = (
+    "<Placemark><name>{name}</name>"
+    "<Style><LineStyle><color>{track_color}</color><width>{track_width}</width></LineStyle>{poly_style}</Style>"
+    "<LineString>{line_options}<coordinates>{coordinates}</coordinates></LineString></Placemark>"
+)
+
+KML_POLY_STYLE_TEMPLATE = "<PolyStyle><color>{poly_color}</color><fill>1</fill><outline>1</outline></PolyStyle>"
+
+KML_FOLDER_TEMPLATE = "<Folder><name>{name}</name>{placemarks}</Folder>"
+
+
+def coordinates_to_kml_placemark_xml(lat, lon, alt,
+                                     name="Placemark Name",
+                                     description="Placemark Description",
+                                     absolute=False,
+                                     icon="https://maps.google.com/mapfiles/kml/shapes/placemark_circle.png",
+                                     scale=1.0):
+    """ Generate a generic placemark, as an XML string """
+
+    return KML_POINT_PLACEMARK_TEMPLATE.format(
+        name=escape(name),
+        description=escape(description),
+        scale=escape(str(scale)),
+        icon=escape(icon),
+        altitude_mode="<altitudeMode>absolute</altitudeMode>" if absolute else "",
+        lat=lat,
+        lon=lon,
+        alt=alt,
+    )
+
 
 def coordinates_to_kml_placemark(lat, lon, alt,
                                  name="Placemark Name",
@@ -207,29 +589,36 @@ def coordinates_to_kml_placemark(lat, lon, alt,
                                  scale=1.0):
     """ Generate a generic placemark object """
 
-    placemark = ET.Element("Placemark")
+    return ET.fromstring(coordinates_to_kml_placemark_xml(lat, lon, alt, name=name, description=description,
+                                                          absolute=absolute, icon=icon, scale=scale))
 
-    pm_name = ET.SubElement(placemark, "name")
-    pm_name.text = name
-    pm_desc = ET.SubElement(placemark, "description")
-    pm_desc.text = description
 
-    style = ET.SubElement(placemark, "Style")
-    icon_style = ET.SubElement(style, "IconStyle")
-    icon_scale = ET.SubElement(icon_style, "scale")
-    icon_scale.text = str(scale)
-    pm_icon = ET.SubElement(icon_style, "Icon")
-    href = ET.SubElement(pm_icon, "href")
-    href.text = icon
+def path_to_kml_placemark_xml(flight_path,
+                              name="Flight Path Name",
+                              track_color="ff03bafc",
+                              poly_color="8003bafc",
+                              track_width=2.0,
+                              absolute=True,
+                              extrude=True):
+    ''' Produce a placemark XML string from a flight path array '''
 
-    point = ET.SubElement(placemark, "Point")
     if absolute:
-        altitude_mode = ET.SubElement(point, "altitudeMode")
-        altitude_mode.text = "absolute"
-    coordinates = ET.SubElement(point, "coordinates")
-    coordinates.text = f"{lon:.6f},{lat:.6f},{alt:.6f}"
+        line_options = ("<extrude>1</extrude>" if extrude else "") + "<altitudeMode>absolute</altitudeMode>"
+    else:
+        line_options = "<tessellate>1</tessellate>"
+
+    # Re-order to (lon, lat, alt) and format the entire block in one go.
+    _points = np.asarray(flight_path, dtype=np.float64).reshape(-1, 3)[:, [1, 0, 2]]
+    coordinates = " ".join(["%.6f,%.6f,%.6f"] * len(_points)) % tuple(_points.ravel().tolist())
 
-    return placemark
+    return KML_PATH_PLACEMARK_TEMPLATE.format(
+        name=escape(name),
+        track_color=escape(track_color),
+        track_width=escape(str(track_width)),
+        poly_style=KML_POLY_STYLE_TEMPLATE.format(poly_color=escape(poly_color)) if extrude else "",
+        line_options=line_options,
+        coordinates=coordinates,
+    )
 
 
 def path_to_kml_placemark(flight_path,
@@ -241,117 +630,109 @@ def path_to_kml_placemark(flight_path,
                           extrude=True):
     ''' Produce a placemark object from a flight path array '''
 
-    placemark = ET.Element("Placemark")
-
-    pm_name = ET.SubElement(placemark, "name")
-    pm_name.text = name
-
-    style = ET.SubElement(placemark, "Style")
-    line_style = ET.SubElement(style, "LineStyle")
-    color = ET.SubElement(line_style, "color")
-    color.text = track_color
-    width = ET.SubElement(line_style, "width")
-    width.text = str(track_width)
-    if extrude:
-        poly_style = ET.SubElement(style, "PolyStyle")
-        color = ET.SubElement(poly_style, "color")
-        color.text = poly_color
-        fill = ET.SubElement(poly_style, "fill")
-        fill.text = "1"
-        outline = ET.SubElement(poly_style, "outline")
-        outline.text = "1"
-
-    line_string = ET.SubElement(placemark, "LineString")
-    if absolute:
-        if extrude:
-            ls_extrude = ET.SubElement(line_string, "extrude")
-            ls_extrude.text = "1"
-        altitude_mode = ET.SubElement(line_string, "altitudeMode")
-        altitude_mode.text = "absolute"
-    else:
-        ls_tessellate = ET.SubElement(line_string, "tessellate")
-        ls_tessellate.text = "1"
-    coordinates = ET.SubElement(line_string, "coordinates")
-    coordinates.text = " ".join(f"{lon:.6f},{lat:.6f},{alt:.6f}" for lat, lon, alt in flight_path)
+    return ET.fromstring(path_to_kml_placemark_xml(flight_path, name=name, track_color=track_color,
+                                                   poly_color=poly_color, track_width=track_width,
+                                                   absolute=absolute, extrude=extrude))
+
 
-    return placemark
+def folder_to_kml_xml(name, placemarks):
+    """ Wrap a list of placemark XML strings up into a KML Folder XML string """
+    return KML_FOLDER_TEMPLATE.format(name=escape(name), placemarks="".join(placemarks))
 
 
-def read_json_file(filename):
+def telemetry_time_order(datetimes):
+    """
+    Given a list of SondeHub datetime strings, return an index array which puts them in time order,
+    with duplicate times removed (the last entry for each time is kept).
+    """
+    _dt = datetimes_to_datetime64(datetimes)
+    _order = np.argsort(_dt, kind='stable')
+    _sorted = _dt[_order]
+    _unique = np.concatenate((_sorted[1:] != _sorted[:-1], [True]))
+    return _order[_unique]
+
+
+def telemetry_to_path(entries, order):
+    """ Gather the lat/lon/alt of a list of telemetry entries into an (N,3) array, in the supplied order """
+    _path = np.array([(_e['lat'], _e['lon'], _e['alt']) for _e in entries], dtype=np.float64).reshape(-1, 3)
+    return _path[order]
+
+
+def read_json_file(filename, data=None):
     """
     Read in a SondeHub Exported JSON file and convert into data that can be used for KML Generation
+    If the file contents have already been read, they can be passed in as data.
     """
 
     output = {}
 
-    _f = open(filename,'r')
-    data = json.loads(_f.read())
-    _f.close()
+    data = json_loads(pathlib.Path(filename).read_bytes() if data is None else data)
 
-    # Read in everything into a dictionary, which de-dupes.
-    _telem = {}
-    for _entry in data:
-        _telem[_entry['datetime']] = _entry
-    
-    # Get keys and sort, now we can pull out data in time order.
-    _telem_dates = list(_telem.keys())
-    _telem_dates.sort()
+    # Sort into time order, de-duping entries with the same time.
+    _order = telemetry_time_order([_entry['datetime'] for _entry in data])
 
-    _first = _telem[_telem_dates[0]]
-    _last = _telem[_telem_dates[-1]]
+    _first = data[_order[0]]
+    _last = data[_order[-1]]
 
     output['serial'] = _first['serial']
     output['last_time'] = _last['datetime']
-
-    _path = []
-    
-    for _entry in _telem_dates:
-        _a = _telem[_entry]
-
-        _path.append([_a['lat'], _a['lon'], _a['alt']])
-
-    output['path'] = _path
+    output['path'] = telemetry_to_path(data, _order)
 
     return output
 
 
-def _log_file_to_kml_folder(filename, absolute=True, extrude=True, last_only=False):
-    ''' Convert a single sonde log file to a KML Folder object '''
+def _log_file_to_kml_folder(filename, absolute=True, extrude=True, last_only=False, data=None):
+    ''' Convert a single sonde log file to a KML Folder XML string '''
 
     # Read file.
-    _flight_data = read_json_file(filename)
+    _flight_data = read_json_file(filename, data=data)
 
     _flight_serial = _flight_data["serial"]
     _landing_time = _flight_data["last_time"]
     _landing_pos = _flight_data["path"][-1]
 
-    _folder = ET.Element("Folder")
-    _name = ET.SubElement(_folder, "name")
-    _name.text = _flight_serial
-
     # Generate the placemark & flight track.
-    _folder.append(coordinates_to_kml_placemark(_landing_pos[0], _landing_pos[1], _landing_pos[2],
-                                                name=_flight_serial, description=_landing_time, absolute=absolute))
+    _placemarks = [coordinates_to_kml_placemark_xml(_landing_pos[0], _landing_pos[1], _landing_pos[2],
+                                                    name=_flight_serial, description=_landing_time, absolute=absolute)]
     if not last_only:
-        _folder.append(path_to_kml_placemark(_flight_data["path"], name="Track",
-                                             absolute=absolute, extrude=extrude))
+        _placemarks.append(path_to_kml_placemark_xml(_flight_data["path"], name="Track",
+                                                     absolute=absolute, extrude=extrude))
+
+    return folder_to_kml_xml(_flight_serial, _placemarks)
+
+
+def write_kml_folders(folders, kml_file):
+    """
+    Stream an iterable of KML Folders (either XML strings or Element objects) out to a KML file.
+    Each folder is written (and flushed) as soon as it is generated, so the whole document is never held in memory.
+    """
 
-    return _folder
+    with open(kml_file, 'wb') as _f:
+        _f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n")
+        _f.write(b'<kml xmlns="http://www.opengis.net/kml/2.2"><Document>')
+        for _folder in folders:
+            if isinstance(_folder, str):
+                _f.write(_folder.encode("utf-8"))
+            else:
+                ET.ElementTree(_folder).write(_f, encoding="UTF-8", xml_declaration=False)
+            _f.flush()
+        _f.write(b'</Document></kml>')
 
 
 def log_files_to_kml(file_list, kml_file, absolute=True, extrude=True, last_only=False):
     """ Convert a collection of log files to a KML file """
 
-    kml_root = ET.Element("kml", xmlns="http://www.opengis.net/kml/2.2")
-    kml_doc = ET.SubElement(kml_root, "Document")
+    def _folders():
+        # Telemetry files can be large, so only read a few ahead of the conversion.
+        for file, data in read_files(file_list, max_workers=4):
+            if data is None:
+                continue
 
-    for file in file_list:
-        logging.debug(f"Converting {file} to KML")
-        try:
-            kml_doc.append(_log_file_to_kml_folder(file, absolute=absolute,
-                                                   extrude=extrude, last_only=last_only))
-        except Exception:
-            logging.exception(f"Failed to convert {file} to KML")
+            logging.debug(f"Converting {file} to KML")
+            try:
+                yield _log_file_to_kml_folder(file, absolute=absolute,
+                                              extrude=extrude, last_only=last_only, data=data)
+            except Exception:
+                logging.exception(f"Failed to convert {file} to KML")
 
-    tree = ET.ElementTree(kml_root)
-    tree.write(kml_file, encoding="UTF-8", xml_declaration=True)
\ No newline at end of file
+    write_kml_folders(_folders(), kml_file)